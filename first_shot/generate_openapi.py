@@ -1,17 +1,10 @@
-from fastapi.openapi.utils import get_openapi
 from main import app
 import json
 
 
 with open("openapi.json", "w") as f:
     json.dump(
-        get_openapi(
-            title=app.title,
-            version=app.version,
-            openapi_version=app.openapi_version,
-            description=app.description,
-            routes=app.routes,
-        ),
+        app.openapi(),  # Also has the models of the bodies read by `validate_body`
         f,
         ensure_ascii=False,
         allow_nan=False,
@@ -5,13 +5,26 @@ Python 3.11.0b4
 
 > pip install fastapi # FastAPI 0.99.0 or above
 > pip install python-multipart # For using Form, File, UploadFile
+> pip install orjson # For ORJSONResponse
+> pip install msgpack # For MessagePack responses, requested with `Accept: application/x-msgpack`
 > uvicorn main:app --reload # to watch the changes, visit localhost:8000 and localhost:8000/docs
 
 The following content in main.py
 """
-from typing import Annotated, Union
+import asyncio
+import email.message
+import logging
+import os
+import sys
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Annotated, Any, Mapping, Sequence, Union
 import time
 
+import anyio
+import msgpack
+import orjson
 from fastapi import (
     FastAPI,
     Query,
@@ -21,20 +34,67 @@ from fastapi import (
     Header,
     Response,
     Form,
-    File,
-    UploadFile,
     HTTPException,
     Request,
     BackgroundTasks,
     Depends,
 )
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse, ORJSONResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field, HttpUrl
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.datastructures import Headers, MutableHeaders
+from pydantic import BaseModel, Field, HttpUrl, TypeAdapter, ValidationError
 import uvicorn
 
-app = FastAPI()  # the name `app` matters, https://fastapi.tiangolo.com/tutorial/first-steps/#first-steps
+logger = logging.getLogger(__name__)
+accept_msgpack: ContextVar[bool] = ContextVar("accept_msgpack", default=False)  # Set by `MsgpackNegotiationMiddleware`
+
+
+def prefers_msgpack(accept: str) -> bool:
+    """Whether the media ranges of an Accept header rank MessagePack above JSON by their `q` values"""
+    quality = {}
+    for media_range in accept.split(","):
+        media_type, *params = (part.strip() for part in media_range.split(";"))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality[media_type.lower()] = q
+    return quality.get("application/x-msgpack", 0.0) > quality.get("application/json", 0.0)
+
+
+class NegotiatedResponse(ORJSONResponse):
+    """Serialize with MessagePack if the client accepts it, otherwise with orjson"""
+
+    def init_headers(self, headers: Mapping[str, str] | None = None) -> None:
+        super().init_headers(headers)
+        self.headers.add_vary_header("Accept")  # The body depends on it, so shared caches must key on it
+
+    def render(self, content: Any) -> bytes:
+        if accept_msgpack.get():
+            self.media_type = "application/x-msgpack"
+            return msgpack.packb(content, use_bin_type=True)
+        return super().render(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):  # https://fastapi.tiangolo.com/advanced/events/#lifespan
+    start_log_writer(app)
+    yield
+    await stop_log_writer(app)
+
+
+app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=NegotiatedResponse,  # https://fastapi.tiangolo.com/advanced/custom-response/
+)  # the name `app` matters, https://fastapi.tiangolo.com/tutorial/first-steps/#first-steps
 
 class Image(BaseModel):
     url: HttpUrl
@@ -68,6 +128,15 @@ class Item(BaseItem):
     images: list[Image] | None = None  # Optional
 
 
+class ItemBody(BaseModel):  # https://fastapi.tiangolo.com/tutorial/body-multiple-params/#embed-a-single-body-parameter
+    item: Item
+
+
+class UpdatedItem(BaseModel):
+    item_id: int
+    item: Item
+
+
 class Offer(BaseModel):
     name: str
     description: str | None = None
@@ -100,9 +169,88 @@ class UnicornException(Exception):
         self.name = name
 
 
+def missing_field_error(*loc: str | int) -> RequestValidationError:
+    """The error of a missing body field, built by pydantic so it matches the other 422 responses"""
+    error = {"type": "missing", "loc": loc, "input": None}
+    return RequestValidationError(ValidationError.from_exception_data("Body", [error]).errors())
+
+
+def is_json_content_type(content_type: str | None) -> bool:
+    """The check FastAPI does before parsing a body as JSON, a missing content type counts as JSON"""
+    if not content_type:
+        return True
+    message = email.message.Message()
+    message["content-type"] = content_type
+    subtype = message.get_content_subtype()
+    return message.get_content_maintype() == "application" and (subtype == "json" or subtype.endswith("+json"))
+
+
+async def validate_body(request: Request, adapter: TypeAdapter, embed: str | None = None) -> Any:
+    """Validate the raw JSON body with pydantic-core, without building an intermediate dict
+
+    Empty and non-JSON bodies give the same 422 errors as a declared body parameter. `embed` names the
+    field of a body declared with `Body(embed=True)`, https://fastapi.tiangolo.com/tutorial/body-multiple-params/
+    """
+    body = await request.body()
+    try:
+        if body and is_json_content_type(request.headers.get("content-type")):
+            return adapter.validate_json(body)
+        if embed or not body:
+            raise missing_field_error("body", *([embed] if embed else []))
+        return adapter.validate_python(body, from_attributes=True)  # Not JSON, FastAPI validates the raw bytes
+    except ValidationError as exc:
+        errors = [{**error, "loc": ("body", *error["loc"])} for error in exc.errors()]
+        raise RequestValidationError(errors)
+
+
+def adapter_response(adapter: TypeAdapter, value: Any) -> Response:
+    """Serialize with pydantic-core, skipping `jsonable_encoder`"""
+    if accept_msgpack.get():
+        return NegotiatedResponse(adapter.dump_python(value, mode="json"))
+    return Response(content=adapter.dump_json(value), media_type="application/json", headers={"Vary": "Accept"})
+
+
+body_schemas: dict[str, dict] = {}  # The models referred to by the bodies read by `validate_body`
+
+
+# https://fastapi.tiangolo.com/advanced/path-operation-advanced-configuration/#custom-openapi-path-operation-schema
+def json_body_openapi_extra(adapter: TypeAdapter) -> dict:
+    """Document the body read by `validate_body`, the models it refers to are added by `openapi`"""
+    schema = adapter.json_schema(ref_template="#/components/schemas/{model}")
+    body_schemas.update(schema.pop("$defs", {}))
+    return {"requestBody": {"content": {"application/json": {"schema": schema}}, "required": True}}
+
+
+def openapi() -> dict:  # https://fastapi.tiangolo.com/how-to/extending-openapi/
+    if not app.openapi_schema:
+        schemas = FastAPI.openapi(app).setdefault("components", {}).setdefault("schemas", {})
+        for name, schema in body_schemas.items():
+            schemas.setdefault(name, schema)
+    return app.openapi_schema
+
+
+app.openapi = openapi
+
+
+# Built once and shared by the routes, https://docs.pydantic.dev/latest/concepts/type_adapter/
+item_body_adapter = TypeAdapter(ItemBody)
+updated_item_adapter = TypeAdapter(UpdatedItem)
+offer_adapter = TypeAdapter(Offer)
+images_adapter = TypeAdapter(list[Image])
+
+
+hello_response = Response(content=orjson.dumps({"msg": "Hello World"}), media_type="application/json")
+
+
 @app.get("/")
 async def read_main():
-    return {"msg": "Hello World"}
+    return hello_response  # The constant response is built once at import
+
+
+stored_items = [{"item_id": "Foo"}, {"item_id": "Bar"}]  # Built once, only read by the handlers
+# Not identifier-like, so not interned by CPython itself, https://docs.python.org/3/library/sys.html#sys.intern
+user_agent_key = sys.intern("User-Agent")
+x_token_key = sys.intern("X-Token values")
 
 
 @app.get("/items/")
@@ -122,24 +270,29 @@ async def read_items(
         ),
     ] = None,  # Optional
 ):
-    results = {"items": [{"item_id": "Foo"}, {"item_id": "Bar"}]}
+    results = {"items": stored_items}
     if q:
-        results.update({"q": q})
+        results["q"] = q  # Item assignment, no temporary dict as with `results.update({"q": q})`
     if ads_id:
-        results.update({"ads_id": ads_id})
+        results["ads_id"] = ads_id
     if user_agent:
-        results.update({"User-Agent": user_agent})
+        results[user_agent_key] = user_agent
     if x_token:
-        results.update({"X-Token values": x_token})
-    return results
+        results[x_token_key] = x_token
+    return NegotiatedResponse(results)  # Returning a Response directly skips `jsonable_encoder`
 
 
-@app.put("/items/{item_id}")
-async def update_item(
-    item_id: int, item: Annotated[Item, Body(embed=True)]
-):  # https://fastapi.tiangolo.com/tutorial/body-multiple-params/#embed-a-single-body-parameter
-    results = {"item_id": item_id, "item": item}
-    return results
+@app.put("/items/{item_id}", openapi_extra=json_body_openapi_extra(item_body_adapter))
+async def update_item(item_id: int, request: Request):
+    body = await validate_body(request, item_body_adapter, embed="item")
+    results = UpdatedItem.model_construct(item_id=item_id, item=body.item)  # Both fields are already validated
+    return adapter_response(updated_item_adapter, results)
+
+
+portal_items = [  # Trusted data, `model_construct` skips the validation. All fields are set to keep the field order
+    Item.model_construct(description=None, type=None, name="Portal Gun", price=42.0, tax=None, tags=None, images=None),
+    Item.model_construct(description=None, type=None, name="Plumbus", price=32.0, tax=None, tags=None, images=None),
+]
 
 
 @app.get("/items/{item_id}")
@@ -156,23 +309,23 @@ async def read_item(
         "importance": importance,
     }
     print(info)
-    return [
-        Item(name="Portal Gun", price=42.0),
-        Item(name="Plumbus", price=32.0),
-    ]
-
-
-@app.get("/travel_items/{item_id}", response_model=Union[PlaneItem, CarItem])
-async def read_item(item_id: str):
-    items = {
-        "item1": {"description": "All my friends drive a low rider", "type": "car"},
-        "item2": {
-            "description": "Music is my aeroplane, it's my aeroplane",
-            "type": "plane",
-            "size": 5,
-        },
-    }
-    return items[item_id]
+    return portal_items
+
+
+travel_items = {
+    "item1": {"description": "All my friends drive a low rider", "type": "car"},
+    "item2": {
+        "description": "Music is my aeroplane, it's my aeroplane",
+        "type": "plane",
+        "size": 5,
+    },
+}
+travel_items_json = {item_id: orjson.dumps(item) for item_id, item in travel_items.items()}  # Serialized once at import
+
+
+@app.get("/travel_items/{item_id}", response_model=Union[PlaneItem, CarItem])  # Only used for docs, data is trusted
+async def read_travel_item(item_id: str):
+    return Response(content=travel_items_json[item_id], media_type="application/json")
 
 
 @app.post("/user/")
@@ -180,26 +333,32 @@ async def create_user(user: UserIn) -> BaseUser:
     return user
 
 
-@app.get("/offers/{offer_id}")
-async def read_offer(offer_id: str) -> Offer:
-    offers = {"foo": "The Foo Wrestlers"}
+offers = {"foo": "The Foo Wrestlers"}
+offer_not_found_response = Response(  # The same response as `HTTPException`, without raising and encoding it each time
+    content=orjson.dumps({"detail": "Offer not found"}),
+    status_code=404,
+    headers={"X-Error": "There goes my error"},
+    media_type="application/json",
+)
+
+
+@app.get("/offers/{offer_id}", response_model=Offer)
+async def read_offer(offer_id: str):
     if offer_id not in offers:
-        raise HTTPException(
-            status_code=404,
-            detail="Offer not found",
-            headers={"X-Error": "There goes my error"},
-        )
+        return offer_not_found_response
     return offers[offer_id]
 
 
-@app.post("/offers/")
-async def create_offer(offer: Offer) -> Offer:
-    return offer
+@app.post("/offers/", response_model=Offer, openapi_extra=json_body_openapi_extra(offer_adapter))
+async def create_offer(request: Request):
+    offer = await validate_body(request, offer_adapter)
+    return adapter_response(offer_adapter, offer)
 
 
-@app.post("/images/multiple/")
-async def create_multiple_images(images: list[Image]):
-    return images
+@app.post("/images/multiple/", openapi_extra=json_body_openapi_extra(images_adapter))
+async def create_multiple_images(request: Request):
+    images = await validate_body(request, images_adapter)
+    return adapter_response(images_adapter, images)
 
 
 @app.post("/index-weights/")
@@ -207,15 +366,52 @@ async def create_index_weights(weights: dict[int, float]):  # Pydantic convert s
     return weights
 
 
+teleport_response = RedirectResponse(url="https://example.com/", status_code=301)  # Permanent, so clients can cache it
+portal_response = Response(
+    content=orjson.dumps({"message": "Here's your interdimensional portal."}), media_type="application/json"
+)
+
+
 @app.get("/portal")
 async def get_portal(teleport: bool = False) -> Response:
-    if teleport:
-        return RedirectResponse(url="https://example.com/")
-    return JSONResponse(content={"message": "Here's your interdimensional portal."})
+    return teleport_response if teleport else portal_response  # Both responses are built once at import
 
 
 ### Static files ###
-app.mount("/static", StaticFiles(directory="static"), name="static")
+class CachedStaticFiles(StaticFiles):
+    """`StaticFiles` keeping the small files in an LRU cache, refreshed when their ETag (mtime and size) changes"""
+
+    def __init__(self, *, max_cached_size: int = 1024 * 1024, max_cached_files: int = 256, **kwargs):
+        super().__init__(**kwargs)
+        if max_cached_size < 0 or max_cached_files < 0:
+            raise ValueError("max_cached_size and max_cached_files must not be negative")
+        self.max_cached_size = max_cached_size  # At most `max_cached_size * max_cached_files` bytes in memory
+        self.max_cached_files = max_cached_files  # 0 disables the cache
+        self.cached_files: OrderedDict[str, tuple[str, bytes]] = OrderedDict()  # Least recently used first
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)  # Still checks the path and answers 304 without I/O
+        if not isinstance(response, FileResponse) or response.status_code != 200:
+            return response
+        response.headers["cache-control"] = "public, max-age=3600"
+        if scope["method"] != "GET" or response.stat_result.st_size > self.max_cached_size or not self.max_cached_files:
+            return response
+        etag = response.headers["etag"]
+        cached_etag, content = self.cached_files.get(response.path, (None, b""))
+        if cached_etag != etag:
+            content = await anyio.Path(response.path).read_bytes()
+            if len(content) != response.stat_result.st_size:  # Changed since the stat, the ETag is stale
+                self.cached_files.pop(response.path, None)
+                return response
+            self.cached_files[response.path] = (etag, content)
+        self.cached_files.move_to_end(response.path)
+        if len(self.cached_files) > self.max_cached_files:
+            self.cached_files.popitem(last=False)
+        headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+        return Response(content=content, headers=headers)
+
+
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 
 ### Form and File ###
@@ -224,22 +420,114 @@ async def login(username: Annotated[str, Form(alias="user-name")], password: Ann
     return {"username": username}
 
 
-@app.post("/files/", deprecated=True)
-async def create_file(
-    file: Annotated[bytes, File(description="A file read as bytes")],
-):  # For small files
-    return {"file_size": len(file)}
+def decode_header_value(value: bytes, charset: str = "utf-8") -> str:
+    """Decode like Starlette's multipart parser, falling back to latin-1"""
+    try:
+        return value.decode(charset)
+    except (UnicodeDecodeError, LookupError):
+        return value.decode("latin-1")
+
+
+async def stream_parts(request: Request, field_name: str, files_only: bool = True) -> list[tuple[str | None, int]]:
+    """The filename and size of each part uploaded as `field_name`, dropping the contents as they stream in"""
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    parts = []
+    if b"boundary" in params:
+        header_field, header_value, content_disposition = bytearray(), bytearray(), bytearray()
+        in_field = False
+
+        def on_header_field(data: bytes, start: int, end: int):
+            header_field.extend(data[start:end])
+
+        def on_header_value(data: bytes, start: int, end: int):
+            header_value.extend(data[start:end])
+
+        def on_header_end():
+            if header_field.lower() == b"content-disposition":
+                content_disposition[:] = header_value
+            header_field.clear()
+            header_value.clear()
+
+        def on_headers_finished():
+            nonlocal in_field
+            _, options = parse_options_header(bytes(content_disposition))
+            in_field = options.get(b"name") == field_name.encode() and (b"filename" in options or not files_only)
+            if in_field:
+                filename = options.get(b"filename")
+                parts.append((None if filename is None else decode_header_value(filename), 0))
+            content_disposition.clear()
+
+        def on_part_data(data: bytes, start: int, end: int):
+            if in_field:
+                filename, size = parts[-1]
+                parts[-1] = (filename, size + end - start)
+
+        parser = MultipartParser(
+            params[b"boundary"],
+            {
+                "on_header_field": on_header_field,
+                "on_header_value": on_header_value,
+                "on_header_end": on_header_end,
+                "on_headers_finished": on_headers_finished,
+                "on_part_data": on_part_data,
+            },
+        )
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+            parser.finalize()
+        except MultipartParseError:
+            raise HTTPException(status_code=400, detail="There was an error parsing the body")
+    elif not files_only:  # Not multipart, e.g. `application/x-www-form-urlencoded`, so only plain values
+        form = await request.form()
+        parts = [(None, len(value.encode())) for value in form.getlist(field_name) if isinstance(value, str)]
+    if not parts:
+        raise missing_field_error("body", field_name)
+    return parts
+
+
+def upload_openapi_extra(field_name: str, field_schema: dict) -> dict:
+    """The multipart body read by `stream_parts` is documented by hand"""
+    return {
+        "requestBody": {
+            "content": {
+                "multipart/form-data": {
+                    "schema": {"type": "object", "properties": {field_name: field_schema}, "required": [field_name]}
+                }
+            },
+            "required": True,
+        }
+    }
+
 
+@app.post(
+    "/files/",
+    deprecated=True,
+    openapi_extra=upload_openapi_extra(
+        "file", {"type": "string", "format": "binary", "description": "A file, only its size is read"}
+    ),
+)
+async def create_file(request: Request):  # The size is counted as the body streams in, the file is never held
+    parts = await stream_parts(request, "file", files_only=False)
+    return {"file_size": parts[-1][1]}  # Like `FormData.get`, the last part wins
 
-@app.post("/uploadfile/")
-async def create_upload_file(
-    file: Annotated[UploadFile, File(description="A file read as UploadFile")],  # For big files
-):
-    return {"filename": file.filename}
+
+@app.post(
+    "/uploadfile/",
+    openapi_extra=upload_openapi_extra(
+        "file", {"type": "string", "format": "binary", "description": "A file, only its filename is read"}
+    ),
+)
+async def create_upload_file(request: Request):  # For big files, only the filename is kept
+    parts = await stream_parts(request, "file")
+    return {"filename": parts[-1][0]}  # Like `FormData.get`, the last part wins
 
 
-@app.post("/uploadfiles/")
-async def create_upload_files(files: list[UploadFile]):
+@app.post(
+    "/uploadfiles/",
+    openapi_extra=upload_openapi_extra("files", {"type": "array", "items": {"type": "string", "format": "binary"}}),
+)
+async def create_upload_files(request: Request):
     """
     An example of frontend page
     <body>
@@ -252,13 +540,13 @@ async def create_upload_files(files: list[UploadFile]):
     <input type="submit">
     </form>
     </body>"""
-    return {"filenames": [file.filename for file in files]}
+    return {"filenames": [filename for filename, _ in await stream_parts(request, "files")]}
 
 
 ### Error Handling ###
 @app.exception_handler(UnicornException)
 async def unicorn_exception_handler(request: Request, exc: UnicornException):
-    return JSONResponse(
+    return NegotiatedResponse(
         status_code=418,
         content={"message": f"Oops! {exc.name} did something. There goes a rainbow..."},
     )
@@ -272,13 +560,37 @@ async def read_unicorn(name: str):
 
 
 ### Middleware ###
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+class MsgpackNegotiationMiddleware:  # Pure ASGI middleware, https://www.starlette.io/middleware/#pure-asgi-middleware
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = Headers(scope=scope).get("accept", "")
+        token = accept_msgpack.set(prefers_msgpack(accept))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            accept_msgpack.reset(token)
+
+
+class ProcessTimeMiddleware:  # Pure ASGI, avoids the task group `@app.middleware("http")` runs for each request
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start_time = time.perf_counter_ns()  # Monotonic, and cheaper than `time.time()`
+
+        async def send_with_process_time(message):
+            if message["type"] == "http.response.start":
+                process_time = (time.perf_counter_ns() - start_time) // 1000
+                MutableHeaders(scope=message)["X-Process-Time"] = str(process_time)  # In microseconds
+            await send(message)
+
+        await self.app(scope, receive, send_with_process_time)
 
 
 origins = [
@@ -288,8 +600,21 @@ origins = [
     "http://localhost:8080",
 ]
 
+
+class FrozenOriginsCORSMiddleware(CORSMiddleware):
+    """`CORSMiddleware` matching the allowed origins with a hashed lookup instead of a list scan"""
+
+    def __init__(self, app, allow_origins: Sequence[str] = (), **kwargs):
+        super().__init__(app, allow_origins=allow_origins, **kwargs)
+        self.allow_origins = frozenset(allow_origins)  # Used by `is_allowed_origin`
+
+
+# The middleware added last is the outermost one, so CORS answers the preflight requests
+# before the timing and the negotiation middleware run
+app.add_middleware(MsgpackNegotiationMiddleware)
+app.add_middleware(ProcessTimeMiddleware)
 app.add_middleware(
-    CORSMiddleware,
+    FrozenOriginsCORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
@@ -298,11 +623,59 @@ app.add_middleware(
 
 
 ### Downstream tasks (only for small background tasks) ###
-def write_log(message: str):
+async def log_writer(queue: asyncio.Queue[str | None]):
+    """Append the queued messages to log.txt in batches, until `None` is queued"""
+    with open("log.txt", mode="a", buffering=1) as log:  # Line buffered, flushed by each write of a batch
+        while True:
+            messages = [await queue.get()]
+            while not queue.empty():
+                messages.append(queue.get_nowait())
+            stop = None in messages
+            batch = "".join(message for message in messages if message is not None)
+            if batch:
+                await asyncio.to_thread(log.write, batch)  # Keep the disk I/O off the event loop
+            if stop:
+                return
+
+
+def append_log(message: str):
     with open("log.txt", mode="a") as log:
         log.write(message)
 
 
+app.state.log_queue = None  # Only set while `log_writer` runs, see `lifespan`
+
+
+def start_log_writer(app: FastAPI):
+    app.state.log_queue = asyncio.Queue(maxsize=10_000)
+    app.state.log_writer = asyncio.create_task(log_writer(app.state.log_queue))
+    app.state.log_writer.add_done_callback(lambda task: on_log_writer_done(app, task))
+
+
+def on_log_writer_done(app: FastAPI, task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:  # E.g. log.txt can not be opened, or the disk is full
+        logger.error("The log writer failed, writing the log directly", exc_info=task.exception())
+        app.state.log_queue = None  # `write_log` falls back to `append_log`
+
+
+async def stop_log_writer(app: FastAPI):
+    queue, app.state.log_queue = app.state.log_queue, None
+    if queue is not None:  # Otherwise the writer has already failed
+        await queue.put(None)
+        await app.state.log_writer
+
+
+async def write_log(message: str):  # Async, so it runs on the event loop where the queue lives
+    queue = app.state.log_queue
+    if queue is not None:
+        try:
+            queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:  # The writer is behind, write this message directly
+            pass
+    await asyncio.to_thread(append_log, message)  # No writer, e.g. the lifespan did not run
+
+
 def get_query(background_tasks: BackgroundTasks, q: str | None = None):
     if q:
         message = f"found query: {q}\n"
@@ -316,8 +689,12 @@ async def send_notification(email: str, background_tasks: BackgroundTasks, q: An
     background_tasks.add_task(write_log, message)
     return {"message": "Message sent"}
 
-if __name__ == "__main__": # for debug
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+openapi()  # Generated once at import, after all the routes, instead of on the first request to /docs
+
+
+if __name__ == "__main__":  # `loop` and `http` default to "auto", which picks uvloop and httptools when installed
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=os.cpu_count())
 """
 More Notes
 # 1
@@ -1,6 +1,11 @@
+from pathlib import Path
+import time
+
+import msgpack
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
-from main import app
+from main import CachedStaticFiles, app
 
 client = TestClient(app)
 
@@ -23,3 +28,250 @@ def test_create_existing_item():
     )
     assert response.status_code == 405
     assert response.json() == {"detail": "Method Not Allowed"}
+
+
+def test_update_item():
+    response = client.put(
+        "/items/5",
+        json={
+            "item": {
+                "name": "Foo",
+                "price": 35.4,
+                "tags": ["rock"],
+                "images": [{"url": "http://example.com/baz.jpg", "name": "The Foo live"}],
+            }
+        },
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {
+        "item_id": 5,
+        "item": {
+            "description": None,
+            "type": None,
+            "name": "Foo",
+            "price": 35.4,
+            "tax": None,
+            "tags": ["rock"],
+            "images": [{"url": "http://example.com/baz.jpg", "name": "The Foo live"}],
+        },
+    }
+
+
+def test_read_travel_item():
+    response = client.get("/travel_items/item2")
+    assert response.status_code == 200
+    assert response.json() == {
+        "description": "Music is my aeroplane, it's my aeroplane",
+        "type": "plane",
+        "size": 5,
+    }
+
+
+def test_read_items_msgpack():
+    response = client.get("/items/", headers={"Accept": "application/x-msgpack"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-msgpack"
+    assert msgpack.unpackb(response.content) == {
+        "items": [{"item_id": "Foo"}, {"item_id": "Bar"}],
+        "User-Agent": "testclient",
+    }
+    assert response.headers["Vary"] == "Accept"
+
+    for accept in ["application/x-msgpack;q=0", "application/json, application/x-msgpack;q=0.5"]:
+        response = client.get("/items/", headers={"Accept": accept})
+        assert response.headers["content-type"] == "application/json"
+        assert response.headers["Vary"] == "Accept"
+
+
+def test_process_time_header():
+    response = client.get("/")
+    assert response.headers["X-Process-Time"].isdigit()
+
+
+def test_cors_preflight():
+    headers = {"Origin": "http://localhost:8080", "Access-Control-Request-Method": "GET"}
+    response = client.options("/", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["Access-Control-Allow-Origin"] == "http://localhost:8080"
+    assert "X-Process-Time" not in response.headers  # Answered by the outermost CORS middleware
+
+    response = client.options("/", headers={**headers, "Origin": "http://example.com"})
+    assert response.status_code == 400
+
+
+def test_create_multiple_images():
+    images = [{"url": "http://example.com/baz.jpg", "name": "The Foo live"}]
+    response = client.post("/images/multiple/", json=images)
+    assert response.status_code == 200
+    assert response.json() == images
+
+    response = client.post("/images/multiple/", json=[{"url": "baz.jpg"}])
+    assert response.status_code == 422
+    assert [error["loc"] for error in response.json()["detail"]] == [["body", 0, "url"], ["body", 0, "name"]]
+
+
+def test_create_upload_files():
+    files = [("files", ("foo.txt", b"foo")), ("files", ("bar.txt", b"bar"))]
+    response = client.post("/uploadfiles/", files=files)
+    assert response.status_code == 200
+    assert response.json() == {"filenames": ["foo.txt", "bar.txt"]}
+
+    body = (
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="files"; filename="\xe9.txt"\r\n\r\n'
+        b"foo\r\n"
+        b"--boundary--\r\n"
+    )
+    headers = {"Content-Type": "multipart/form-data; boundary=boundary"}
+    response = client.post("/uploadfiles/", content=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"filenames": ["\u00e9.txt"]}  # Not UTF-8, decoded as latin-1
+
+    response = client.post("/uploadfiles/", data={"files": "not a file"})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["url"].endswith("/v/missing")
+
+
+def test_create_upload_file_last_part():
+    files = [("file", ("foo.txt", b"foo")), ("file", ("bar.txt", b"bar"))]
+    response = client.post("/uploadfile/", files=files)
+    assert response.status_code == 200
+    assert response.json() == {"filename": "bar.txt"}
+
+
+def test_read_items_query():
+    response = client.get("/items/", params={"item-query": "q:foo"})
+    assert response.status_code == 200
+    assert response.json()["q"] == "q:foo"
+
+    response = client.get("/items/", params={"item-query": "foo"})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "string_pattern_mismatch"
+
+
+def test_update_item_invalid_price():
+    response = client.put("/items/5", json={"item": {"name": "Foo", "price": 0}})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "item", "price"]
+
+
+def test_read_static_file():
+    response = client.get("/static/__init__.py")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "public, max-age=3600"
+
+    response = client.get("/static/__init__.py", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+def test_static_files_cache_limit(tmp_path):
+    for name in ["a.js", "b.js", "c.js"]:
+        (tmp_path / name).write_text(f"// {name}")
+    static_app = FastAPI()
+    static_files = CachedStaticFiles(directory=tmp_path, max_cached_files=2)
+    static_app.mount("/static", static_files)
+    static_client = TestClient(static_app)
+    for name in ["a.js", "b.js", "a.js", "c.js"]:
+        response = static_client.get(f"/static/{name}")
+        assert response.text == f"// {name}"
+        assert response.headers["Content-Length"] == str(len(response.content))
+    assert [Path(path).name for path in static_files.cached_files] == ["a.js", "c.js"]
+
+
+def test_static_files_without_cache(tmp_path):
+    (tmp_path / "a.js").write_text("// a.js")
+    static_app = FastAPI()
+    static_app.mount("/static", CachedStaticFiles(directory=tmp_path, max_cached_files=0))
+    static_client = TestClient(static_app)
+    for method in ["GET", "HEAD"]:
+        response = static_client.request(method, "/static/a.js")
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == "public, max-age=3600"
+
+
+def test_create_offer():
+    offer = {
+        "name": "Foo",
+        "description": None,
+        "price": 42.0,
+        "items": [
+            {"description": None, "type": None, "name": "Bar", "price": 3.5, "tax": None, "tags": None, "images": None}
+        ],
+    }
+    response = client.post("/offers/", json=offer)
+    assert response.status_code == 200
+    assert response.json() == offer
+
+
+def test_read_offer_not_found():
+    response = client.get("/offers/bar")
+    assert response.status_code == 404
+    assert response.headers["X-Error"] == "There goes my error"
+    assert response.json() == {"detail": "Offer not found"}
+
+
+def test_create_file():
+    response = client.post("/files/", files={"file": ("foo.bin", b"\0" * 100_000)})
+    assert response.status_code == 200
+    assert response.json() == {"file_size": 100_000}
+
+    response = client.post("/files/", files=[("file", ("foo.bin", b"a")), ("file", ("bar.bin", b"bc"))])
+    assert response.json() == {"file_size": 2}
+
+    response = client.post("/files/", data={"file": "hello"})  # URL encoded
+    assert response.status_code == 200
+    assert response.json() == {"file_size": 5}
+
+
+def test_get_portal():
+    response = client.get("/portal", params={"teleport": True}, follow_redirects=False)
+    assert response.status_code == 301
+    assert response.headers["Location"] == "https://example.com/"
+
+    response = client.get("/portal")
+    assert response.status_code == 200
+    assert response.json() == {"message": "Here's your interdimensional portal."}
+
+
+def test_send_notification_log(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with TestClient(app) as lifespan_client:  # Runs the startup and shutdown events, so the log writer too
+        for email in ["foo@example.com", "bar@example.com"]:
+            response = lifespan_client.post(f"/send-notification/{email}", params={"q": email[:3]})
+            assert response.status_code == 200
+    assert (tmp_path / "log.txt").read_text() == (
+        "found query: foo\nmessage to foo@example.com\nfound query: bar\nmessage to bar@example.com\n"
+    )
+
+    response = client.post("/send-notification/baz@example.com")  # Without the log writer
+    assert response.status_code == 200
+    assert (tmp_path / "log.txt").read_text().endswith("message to bar@example.com\nmessage to baz@example.com\n")
+
+
+def test_send_notification_log_writer_failure(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "log.txt").mkdir()  # The log writer can not open it
+    with TestClient(app) as lifespan_client:
+        for _ in range(100):
+            if app.state.log_queue is None:
+                break
+            time.sleep(0.01)
+        assert app.state.log_queue is None  # Reset once the log writer failed
+        (tmp_path / "log.txt").rmdir()
+        response = lifespan_client.post("/send-notification/foo@example.com")
+        assert response.status_code == 200
+    assert (tmp_path / "log.txt").read_text() == "message to foo@example.com\n"
+
+
+def test_update_item_without_json_body():
+    body = b'{"item": {"name": "Foo", "price": 1}}'
+    for content, headers in [(b"", {}), (body, {"Content-Type": "text/plain"})]:
+        response = client.put("/items/5", content=content, headers=headers)
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["type"] == "missing"
+        assert response.json()["detail"][0]["loc"] == ["body", "item"]
+
+    headers = {"Content-Type": "application/json; charset=utf-8"}
+    response = client.post("/images/multiple/", content=b"[]", headers=headers)
+    assert response.status_code == 200